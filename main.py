@@ -1,36 +1,66 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import os
+import sys
+import logging
+import hashlib
+import anyio.to_thread
 import uvicorn
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import Response, RedirectResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from src import chat_interface
-from src.browser_agent import BrowserAgent
+from src.browser_agent import BrowserAgent, close_http_client
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start a browser agent for this worker and stop it on shutdown"""
+    # Raise the thread pool size (default 40) so blocking calls don't starve
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = 100
+
+    # Initialize browser agent with default configuration
+    app.state.browser_agent = BrowserAgent()
+
+    # Inject browser agent into chat interface
+    chat_interface.set_browser_agent(app.state.browser_agent)
+    await chat_interface.chat_manager.create_indexes()
+
+    await app.state.browser_agent.start()
+    try:
+        yield
+    finally:
+        await app.state.browser_agent.stop()
+        await close_http_client()
+
+
 # Initialize FastAPI app
-app = FastAPI(title="Browser Automation AI Agent")
+app = FastAPI(
+    title="Browser Automation AI Agent",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
-# Add CORS middleware
+# Add CORS middleware. Browsers reject a wildcard origin together with
+# credentials, so the allowed origins are listed explicitly
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=os.getenv("CORS_ORIGINS", "http://localhost:8000").split(","),
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
-# Initialize browser agent with default configuration
-browser_agent = BrowserAgent()
-
-# Inject browser agent into chat interface
-chat_interface.set_browser_agent(browser_agent)
-
 # Include the chat interface router
 app.include_router(chat_interface.router, prefix="")
 
@@ -41,6 +71,11 @@ static_dir = os.path.join(os.path.dirname(
 # Mount static files
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# Read the chat page once at startup instead of on every request
+with open(os.path.join(static_dir, "index.html"), "rb") as f:
+    index_html = f.read()
+index_etag = f'"{hashlib.md5(index_html).hexdigest()}"'
+
 
 class Command(BaseModel):
     command: str
@@ -55,35 +90,17 @@ class BrowserConfig(BaseModel):
     extensions: Optional[List[str]] = None
 
 
-@app.on_event("startup")
-async def startup_event():
-    global browser_agent
-    await browser_agent.start()
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    global browser_agent
-    await browser_agent.stop()
-
-
 @app.post("/api/configure")
 async def configure_browser(config: BrowserConfig):
     """Configure browser with proxy settings and extensions"""
     try:
-        global browser_agent
-        # Stop the current browser instance
-        await browser_agent.stop()
-
-        # Create a new browser agent with the new configuration
-        browser_agent = BrowserAgent(
+        # Recycle the page and its browser context; the browser itself is
+        # only relaunched when the extensions change
+        await app.state.browser_agent.reconfigure(
             proxy_config=config.proxy_config,
             extensions=config.extensions
         )
 
-        # Start the browser with new configuration
-        await browser_agent.start()
-
         return {"status": "success", "message": "Browser configured successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -92,8 +109,7 @@ async def configure_browser(config: BrowserConfig):
 @app.post("/api/interact")
 async def interact(command: Command):
     try:
-        global browser_agent
-        result = await browser_agent.execute_command(command.command)
+        result = await app.state.browser_agent.execute_command(command.command)
         if result["status"] == "error":
             raise HTTPException(status_code=400, detail=result["message"])
         return result
@@ -105,8 +121,7 @@ async def interact(command: Command):
 async def extract(request: ExtractionRequest):
     """Extract data from the current page based on natural language query"""
     try:
-        global browser_agent
-        result = await browser_agent.extract(request.query)
+        result = await app.state.browser_agent.extract(request.query)
         if result["status"] == "error":
             raise HTTPException(status_code=400, detail=result["message"])
         return result
@@ -118,7 +133,7 @@ async def extract(request: ExtractionRequest):
 async def create_new_chat():
     """Create a new chat and redirect to it"""
     try:
-        print("Creating new chat")
+        logger.debug("Creating new chat")
         chat_id = await chat_interface.chat_manager.create_chat()
         return RedirectResponse(url=f"/chat/{chat_id}")
     except Exception as e:
@@ -126,7 +141,7 @@ async def create_new_chat():
 
 
 @app.get("/chat/{chat_id}")
-async def get_chat_page(chat_id: str):
+async def get_chat_page(chat_id: str, request: Request):
     """Serve the chat interface for a specific chat ID"""
     try:
         # First validate if chat exists
@@ -135,8 +150,11 @@ async def get_chat_page(chat_id: str):
             # If chat doesn't exist, redirect to new chat
             return RedirectResponse(url="/chat/new")
 
-        # If chat exists, serve the page
-        return FileResponse(os.path.join(static_dir, "index.html"))
+        # If chat exists, serve the page, letting browsers revalidate their copy
+        headers = {"ETag": index_etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == index_etag:
+            return Response(status_code=304, headers=headers)
+        return Response(index_html, media_type="text/html", headers=headers)
     except Exception as e:
         # If there's any error, redirect to new chat
         return RedirectResponse(url="/chat/new")
@@ -149,4 +167,13 @@ async def get_root():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Every worker launches its own Chrome on the same debugging port, so only
+    # raise UVICORN_WORKERS once the agent is configured with distinct ports
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("UVICORN_WORKERS", "1")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
+    )
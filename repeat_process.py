@@ -1,19 +1,30 @@
 import asyncio
 import os
+import sys
 import argparse
 import websockets
-import json
-from src.chat_interface import chat_manager, repeat_chat_process, process_message
+import orjson
+from src.chat_interface import chat_manager, repeat_chat_process, process_message, decision_cache
 from dotenv import load_dotenv
 
+# Seconds to wait between replayed messages. The old fixed 1s pause only made
+# the replay easier to follow by eye; the WebSocket frames already stream each
+# turn as it completes, so no pause is the default
+PACING = float(os.getenv("REPEAT_PACING", "0"))
+
 
 async def send_ws_message(websocket, message_type, content):
     """Send a message through WebSocket"""
+    await send_ws_messages(websocket, [{
+        "type": message_type,
+        "content": content
+    }])
+
+
+async def send_ws_messages(websocket, messages):
+    """Send several messages through WebSocket in a single frame"""
     try:
-        await websocket.send(json.dumps({
-            "type": message_type,
-            "content": content
-        }))
+        await websocket.send(orjson.dumps(messages).decode())
     except Exception as e:
         print(f"Error sending WebSocket message: {str(e)}")
 
@@ -29,21 +40,23 @@ async def run_repeat_process(chat_id: str, websocket):
         new_chat_id = await chat_manager.create_chat()
         print(f"Created new chat: {new_chat_id}")
 
+        # Embed all messages at once instead of one request per message
+        await decision_cache.prefetch([msg["content"] for msg in user_messages])
+
         # Process each message
         for i, message in enumerate(user_messages):
-            # Show user message
+            # Show the user message while it is being processed
             await send_ws_message(websocket, "user_message", message["content"])
 
-            # Process the message
-            await chat_manager.save_message(new_chat_id, "user", message["content"])
+            # Process the message; process_message also saves it to the new chat
             result = await process_message(new_chat_id, message)
 
-            # Show assistant response
             if result.get("response"):
                 await send_ws_message(websocket, "assistant_message", result["response"])
 
-            # Wait a bit between messages for better visibility
-            await asyncio.sleep(1)
+            # Optionally wait between messages for better visibility
+            if PACING:
+                await asyncio.sleep(PACING)
 
         print(f"Successfully completed repeat process for chat {chat_id}")
     except Exception as e:
@@ -57,7 +70,7 @@ async def main(chat_id: str):
 
     # Connect to WebSocket
     uri = f"ws://localhost:8000/api/ws/chat/{chat_id}"
-    async with websockets.connect(uri) as websocket:
+    async with websockets.connect(uri, compression="deflate") as websocket:
         # Run the repeat process with WebSocket connection
         await run_repeat_process(chat_id, websocket)
 
@@ -67,4 +80,9 @@ if __name__ == "__main__":
     parser.add_argument('--chat_id', help='The ID of the chat to repeat')
     args = parser.parse_args()
 
-    asyncio.run(main(args.chat_id))
+    if sys.platform == "win32":
+        asyncio.run(main(args.chat_id))
+    else:
+        # Same event loop as the server (see main.py)
+        import uvloop
+        uvloop.run(main(args.chat_id))
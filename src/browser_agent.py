@@ -1,52 +1,335 @@
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Deque, Iterable, Callable, Awaitable
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
-import json
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+import orjson
 import time
 import base64
 from io import BytesIO
-import datetime
 import websockets
 import asyncio
 import subprocess
-import psutil
 import signal
-import aiohttp
+import httpx
 import platform
+import logging
 import os.path
+import contextvars
+import functools
+import hashlib
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
 
 from src.id_manager import IdManager
+from src.page_session import CdpConnection, PageSession
+from src.semantic_cache import SemanticCache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# HTTP client shared by the OpenAI clients of every agent, so TLS connections
+# are reused and concurrent requests are multiplexed over HTTP/2
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+)
+# HTTP client for the browser's DevTools endpoint. It ignores proxy settings
+# from the environment, which would otherwise route localhost through a proxy
+_devtools_client = httpx.AsyncClient(trust_env=False)
+
+
+async def close_http_client():
+    """Close the HTTP clients shared by every agent"""
+    await asyncio.gather(_http_client.aclose(), _devtools_client.aclose())
+
+
+def _save_base64(path: str, data: str):
+    """Decode base64 data and write it to a file"""
+    with open(path, 'wb') as f:
+        f.write(base64.b64decode(data))
+
+# Viewport used for the browser window and the emulated page
+_VIEWPORT = {"width": 1920, "height": 1080}
+
+# OpenAI looks at "low" detail images at 512x512, so larger screenshots only
+# cost upload time
+_SCREENSHOT_SIZE = 512
+
+# DevTools connection settings. Screenshot replies run to several MB, well
+# past the 1 MiB default frame limit; the connection is local, so
+# compression and keepalive pings are only overhead
+_CDP_WS_OPTIONS = {
+    "max_size": 64 * 2**20,
+    "read_limit": 2**20,
+    "compression": None,
+    "ping_interval": None
+}
+
+# Chrome flags that don't depend on the agent's configuration
+_CHROME_ARGS = (
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-features=IsolateOrigins,site-per-process',
+    '--disable-site-isolation-trials',
+    '--disable-web-security',
+    f'--window-size={_VIEWPORT["width"]},{_VIEWPORT["height"]}',
+    '--remote-allow-origins=*',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--disable-gpu',
+    '--disable-background-timer-throttling'
+)
+
+# Events after which node ids from DOM.getDocument no longer apply
+_DOCUMENT_EVENTS = frozenset((
+    "DOM.documentUpdated",
+    "Page.frameNavigated",
+    "Page.loadEventFired"
+))
+
+# Events the reader acts on. Chrome writes "method" first in event frames, so
+# any other event is recognised by its prefix and dropped without parsing
+_HANDLED_EVENTS = _DOCUMENT_EVENTS | {
+    "Page.frameStartedLoading",
+    "Page.frameStoppedLoading"
+}
+_EVENT_PREFIX = '{"method":"'
+
+# Pre-serialized frames of the commands sent without parameters; only the
+# command id needs to be filled in
+_CDP_TEMPLATES = {
+    method: '{"id":%d,"method":"' + method + '"}'
+    for method in (
+        "Browser.getVersion",
+        "DOM.enable",
+        "DOM.getDocument",
+        "Page.enable",
+        "Page.getLayoutMetrics",
+        "Page.getNavigationHistory",
+        "Runtime.enable",
+        "Security.enable"
+    )
+}
+
+# Called on an input element to clear it. It is the same for every call, so
+# V8 can reuse its compiled code
+_CLEAR_VALUE_FUNCTION = """
+function() {
+    this.value = '';
+    // Trigger input event to ensure the change is registered
+    this.dispatchEvent(new Event('input', { bubbles: true }));
+    return true;
+}
+"""
+
+# System prompt for execute_command. It is kept byte-for-byte identical across
+# calls so that OpenAI can reuse the cached prompt prefix
+_EXECUTE_SYSTEM_PROMPT = """
+You are a browser automation assistant. Carry out the user's command by calling the browser tools. You can call several tools in one response; they are executed in order, so plan as many steps as you can without seeing the page.
+Set needs_page_info to true on a tool call if you need to see the page information (URL, title and screenshot) after that action before deciding the next one. If the user command has been executed, set it to false. Only set it to true if the user command has not been executed, confirm this from the screenshot.
+When the command has been executed, reply without calling any tool.
+
+Extra Information:
+- If you are trying to input something at google.com then the selector is 'textarea[name="q"]'
+"""
+
+# System prompt for extract, kept constant for the same reason
+_EXTRACT_SYSTEM_PROMPT = """
+You are a web scraping assistant. Your task is to determine the best CSS selector and attribute to extract data from a webpage based on a natural language query. Your response should be parsable using Python's json.loads function without any additional formatting.
+
+The json should have the following fields:
+- selector: The CSS selector to use
+- attribute: The attribute to extract (optional, if not provided, text content will be extracted)
+- multiple: Boolean indicating whether to get all matching elements or just the first one
+- explanation: A brief explanation of why these parameters were chosen
+"""
+
+# Parameters shared by every browser tool
+_PAGE_INFO_PARAMETERS = {
+    "needs_page_info": {
+        "type": "boolean",
+        "description": "Whether you need to see the current page state after this action before proceeding"
+    },
+    "extract_data": {
+        "type": "string",
+        "description": "If needs_page_info is true, a natural language description of the data to extract from the page. This will be passed to another AI agent to extract the data based on the selector and attribute"
+    }
+}
+
+
+def _browser_tool(name: str, description: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the OpenAI tool definition for a browser action"""
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {**parameters, **_PAGE_INFO_PARAMETERS},
+                "required": [*parameters, "needs_page_info"]
+            }
+        }
+    }
+
+
+_BROWSER_TOOLS = [
+    _browser_tool("no_action", "Do nothing. Use it if you only need to see the page information screenshot.", {}),
+    _browser_tool("navigate", "Navigate to a URL.", {
+        "url": {"type": "string", "description": "The URL to navigate to"}
+    }),
+    _browser_tool("click", "Click on an element.", {
+        "selector": {"type": "string", "description": "CSS selector of the element to click"}
+    }),
+    _browser_tool("type", "Type text into an input element.", {
+        "selector": {"type": "string", "description": "CSS selector of the input element"},
+        "text": {"type": "string", "description": "The text to type"}
+    }),
+    _browser_tool("search", "Open a page, type a query into its search box and submit it.", {
+        "url": {"type": "string", "description": "The URL to navigate to"},
+        "selector": {"type": "string", "description": "CSS selector of the search input"},
+        "text": {"type": "string", "description": "The text to search for"},
+        "submit_selector": {"type": "string", "description": "CSS selector of the submit button"}
+    }),
+    _browser_tool("login", "Perform a login.", {
+        "url": {"type": "string", "description": "The login page URL"},
+        "username_selector": {"type": "string", "description": "CSS selector of the username/email field"},
+        "password_selector": {"type": "string", "description": "CSS selector of the password field"},
+        "username": {"type": "string", "description": "The username/email to enter"},
+        "password": {"type": "string", "description": "The password to enter"},
+        "submit_selector": {"type": "string", "description": "CSS selector of the login/submit button"}
+    })
+]
+
 
 class BrowserAgent:
-    def __init__(self, proxy_config: Optional[Dict[str, str]] = None, extensions: Optional[List[str]] = None):
+    # Seconds to wait for a page's load event before carrying on
+    LOAD_TIMEOUT = 30
+    # Seconds to wait for an input event to start a navigation
+    NAVIGATION_START_TIMEOUT = 1
+    # Seconds to wait for a launched browser to accept connections
+    STARTUP_TIMEOUT = 20
+    # Seconds to let the browser exit cleanly before killing it
+    SHUTDOWN_TIMEOUT = 2
+    # Chat messages kept in memory; older ones are dropped as new ones arrive
+    CHAT_HISTORY_SIZE = 200
+
+    def __init__(self, proxy_config: Optional[Dict[str, str]] = None, extensions: Optional[List[str]] = None, pool_size: Optional[int] = None):
         """
         Initialize the browser agent with optional proxy and extension configurations.
 
         Args:
             proxy_config: Dictionary containing proxy settings (e.g., {'server': 'http://proxy:port'})
             extensions: List of paths to Chrome extensions to load
+            pool_size: Number of pages kept open for concurrent commands (defaults to BROWSER_POOL_SIZE or 1)
         """
 
         # Initialize OpenAI client
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=_http_client
+        )
         self.browser_process = None
-        self.ws = None
+        self.browser_connection: Optional[CdpConnection] = None
         self.debug_port = None
+        self.pool_size = pool_size or int(os.getenv("BROWSER_POOL_SIZE", "1"))
+        # LIFO so that back-to-back commands keep landing on the same page
+        self._pool = asyncio.LifoQueue()
+        self._sessions: List[PageSession] = []
+        self._active_session = contextvars.ContextVar(
+            "active_session", default=None)
+        # Each request task sees its own chat, so concurrent commands don't
+        # read or extend each other's history
+        self._chat_history = contextvars.ContextVar(
+            "chat_history", default=None)
         self.id_manager = IdManager()
         self.proxy_config = proxy_config
         self.extensions = extensions or []
         self.system = platform.system().lower()
-        self.chat_history = []
+        # Skips the Chrome lookup, e.g. for a browser outside the usual paths
+        self.chrome_path_override: Optional[str] = os.getenv("CHROME_PATH")
+
+        # Browser tool name -> method performing it
+        self._actions: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+            "no_action": self._do_no_action,
+            "navigate": self._do_navigate,
+            "click": self._do_click,
+            "type": self._do_type,
+            "search": self._do_search,
+            "login": self._do_login
+        }
 
-    def _get_chrome_path(self) -> str:
-        """Get the path to Chrome executable based on OS"""
-        if self.system == "darwin":  # macOS
+        # Model results reused for near-identical requests; extraction needs
+        # a closer match since a different selector returns different data
+        self.command_cache = SemanticCache(self.client, threshold=0.95)
+        self.extract_cache = SemanticCache(self.client, threshold=0.98)
+
+        # Only keep copies of screenshots on disk when debugging
+        self.screenshot_dir = "screenshots" if os.getenv("DEBUG_SCREENSHOTS") else None
+        if self.screenshot_dir:
+            os.makedirs(self.screenshot_dir, exist_ok=True)
+
+    @property
+    def chat_history(self) -> Deque[Dict[str, Any]]:
+        """Recent chat messages of the current task, oldest first"""
+        history = self._chat_history.get()
+        if history is None:
+            history = deque(maxlen=self.CHAT_HISTORY_SIZE)
+            self._chat_history.set(history)
+        return history
+
+    @chat_history.setter
+    def chat_history(self, messages: Iterable[Dict[str, Any]]):
+        self._chat_history.set(deque(messages, maxlen=self.CHAT_HISTORY_SIZE))
+
+    @property
+    def _session(self) -> Optional[PageSession]:
+        """Page session used by the current task"""
+        session = self._active_session.get()
+        if session is None and self._sessions:
+            session = self._sessions[0]
+        return session
+
+    @property
+    def ws(self):
+        """CDP connection of the page used by the current task"""
+        session = self._session
+        return session.ws if session else None
+
+    @asynccontextmanager
+    async def _page(self):
+        """Check a page out of the pool for the duration of a command"""
+        if self._active_session.get() is not None:
+            # Nested calls (e.g. extract during execute_command) share the page
+            yield
+            return
+
+        if not self._sessions:
+            # Waiting on the pool would block forever, e.g. after a failed restart
+            raise Exception("Browser is not running")
+        session = await self._pool.get()
+        token = self._active_session.set(session)
+        try:
+            yield
+        finally:
+            self._active_session.reset(token)
+            # Pages replaced by new_session while checked out are not returned
+            if session in self._sessions:
+                self._pool.put_nowait(session)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_chrome_path(system: str) -> str:
+        """Get the path to Chrome executable based on OS, looked up once per process"""
+        if system == "darwin":  # macOS
             return "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
-        elif self.system == "linux":
+        elif system == "linux":
             # Try common Linux Chrome paths
             possible_paths = [
                 "/usr/bin/google-chrome",
@@ -70,42 +353,46 @@ class BrowserAgent:
                     return path
             return "chrome"  # Fallback to PATH
 
-    def _get_user_data_dir(self) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_user_data_dir(system: str) -> str:
         """Get the appropriate user data directory based on OS"""
-        if self.system == "darwin":  # macOS
+        if system == "darwin":  # macOS
             return "/tmp/chrome-automation"
-        elif self.system == "linux":
+        elif system == "linux":
             return "/tmp/chrome-automation"
         else:  # Windows
             return os.path.join(os.getenv("TEMP", "C:\\temp"), "chrome-automation")
 
     async def start(self):
-        """Start a native browser instance with remote debugging enabled"""
+        """Start the browser if needed and open a fresh page"""
+        await self._ensure_browser()
+        await self.new_session()
+
+    async def _ensure_browser(self):
+        """Start a native browser instance with remote debugging enabled, unless one is already running"""
+        if self.browser_process and self.browser_process.poll() is None:
+            return
+
         self.debug_port = 9222  # Default Chrome debugging port
 
-        chrome_path = self._get_chrome_path()
+        chrome_path = self.chrome_path_override or self._get_chrome_path(self.system)
         chrome_args = [
             chrome_path,
             f'--remote-debugging-port={self.debug_port}',
-            '--no-first-run',
-            '--no-default-browser-check',
-            f'--user-data-dir={self._get_user_data_dir()}',
-            '--disable-blink-features=AutomationControlled',
-            '--disable-features=IsolateOrigins,site-per-process',
-            '--disable-site-isolation-trials',
-            '--disable-web-security',
-            '--window-size=1920,1080',
-            '--remote-allow-origins=*',
-            '--no-sandbox',
-            '--disable-setuid-sandbox',
-            '--disable-dev-shm-usage',
-            '--disable-accelerated-2d-canvas',
-            '--disable-gpu'
+            f'--user-data-dir={self._get_user_data_dir(self.system)}',
+            *_CHROME_ARGS
         ]
 
-        # Add proxy configuration if provided
+        # Nobody watches the window in production, so run headless unless
+        # HEADLESS=0 is set
+        if os.getenv("HEADLESS", "1") == "1":
+            chrome_args.append('--headless=new')
+
+        # Add proxy configuration if provided. Without extensions the proxy
+        # server is applied per browser context instead (see _open_page)
         if self.proxy_config:
-            if 'server' in self.proxy_config:
+            if 'server' in self.proxy_config and self.extensions:
                 chrome_args.append(
                     f'--proxy-server={self.proxy_config["server"]}')
             if 'username' in self.proxy_config and 'password' in self.proxy_config:
@@ -120,334 +407,476 @@ class BrowserAgent:
             chrome_args.append(
                 f'--disable-extensions-except={extension_paths}')
 
-        print(f"Starting Chrome with arguments: {' '.join(chrome_args)}")
-        self.browser_process = subprocess.Popen(chrome_args)
+        logger.info(f"Starting Chrome with arguments: {' '.join(chrome_args)}")
+        # In its own process group, so that stop can signal all of Chrome's
+        # helper processes at once
+        self.browser_process = subprocess.Popen(
+            chrome_args, start_new_session=True)
 
-        # Wait for browser to start and connect to debugging protocol
-        await asyncio.sleep(2)  # Give browser time to start
+        # Connect to debugging protocol as soon as the browser is up
         await self._connect_to_browser()
 
     async def _connect_to_browser(self):
         """Connect to browser's debugging protocol"""
         try:
-            # First try to connect to the version endpoint using HTTP
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get(f'http://localhost:{self.debug_port}/json/version') as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            ws_url = data['webSocketDebuggerUrl']
-                            print(f"Got WebSocket URL: {ws_url}")
-                        else:
-                            raise Exception(
-                                f"Failed to get WebSocket URL. Status: {response.status}")
-                except Exception as e:
-                    print(
-                        f"Failed to connect to Chrome debugging endpoint: {e}")
+            # First try to connect to the version endpoint using HTTP. The
+            # shared client is reused rather than opening a session for a
+            # single loopback request
+            try:
+                response = await self._get_browser_version()
+                if response.status_code == 200:
+                    data = response.json()
+                    ws_url = data['webSocketDebuggerUrl']
+                    logger.debug(f"Got WebSocket URL: {ws_url}")
+                else:
+                    raise Exception(
+                        f"Failed to get WebSocket URL. Status: {response.status_code}")
+            except Exception as e:
+                logger.error(
+                    f"Failed to connect to Chrome debugging endpoint: {e}")
+                raise
+
+            # Connect to the browser target, used to manage contexts and pages
+            self.browser_connection = CdpConnection(
+                await websockets.connect(ws_url, **_CDP_WS_OPTIONS))
+            self.browser_connection.reader_task = asyncio.create_task(
+                self._reader_loop(self.browser_connection))
+            logger.info(f"Connected to Chrome at {ws_url}")
+
+        except Exception as e:
+            logger.error(f"Failed to connect to browser: {e}")
+            raise
+
+    async def _get_browser_version(self):
+        """Request /json/version, polling with backoff until the browser starts listening"""
+        delay = 0.025
+        deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        while True:
+            try:
+                return await _devtools_client.get(f'http://localhost:{self.debug_port}/json/version')
+            except httpx.TransportError:
+                if self.browser_process and self.browser_process.poll() is not None:
+                    raise Exception("Browser exited during startup")
+                if time.monotonic() + delay > deadline:
                     raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.4)
+
+    async def _browser_call(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Send a command over the browser connection and wait for its response"""
+        return await self._send(self.browser_connection, method, params)
 
-            # Connect to WebSocket
-            self.ws = await websockets.connect(ws_url)
-            print(f"Connected to Chrome at {ws_url}")
-
-            # Get list of targets first
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f'http://localhost:{self.debug_port}/json/list') as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        print(f"Available targets: {data}")
-                        # Find the first page target
-                        for target in data:
-                            if target.get('type') == 'page':
-                                ws_url = target['webSocketDebuggerUrl']
-                                print(
-                                    f"Found page WebSocket URL: {ws_url}")
-                                # Connect to the page
-                                self.ws = await websockets.connect(ws_url)
-                                print(f"Connected to page at {ws_url}")
-                                break
-
-            # Enable necessary domains for the page
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Page domain enabled: {response}")
-
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"DOM domain enabled: {response}")
-
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Input.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Input domain enabled: {response}")
-
-            # Set viewport size
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Emulation.setDeviceMetricsOverride",
-                "params": {
-                    "width": 1920,
-                    "height": 1080,
+    async def _reader_loop(self, session: CdpConnection):
+        """Read a connection, resolving command futures by id and tracking page events"""
+        try:
+            async for message in session.ws:
+                if message.startswith(_EVENT_PREFIX):
+                    start = len(_EVENT_PREFIX)
+                    if message[start:message.find('"', start)] not in _HANDLED_EVENTS:
+                        continue
+                data = orjson.loads(message)
+                future = session.pending.get(data.get("id"))
+                if future is not None:
+                    if not future.done():
+                        future.set_result(data)
+                elif "method" in data:
+                    # Only page connections enable the domains sending events
+                    if data["method"] in _DOCUMENT_EVENTS:
+                        session.root_node_id = None
+                    if data["method"] == "Page.loadEventFired":
+                        session.loaded.set()
+                    elif (data["method"] == "Page.frameStartedLoading"
+                          and data["params"].get("frameId") == session.target_id):
+                        # A page's main frame shares its target id
+                        session.loaded.clear()
+                        session.navigation_started.set()
+                    elif (data["method"] == "Page.frameStoppedLoading"
+                          and data["params"].get("frameId") == session.target_id):
+                        # Downloads, 204 responses and aborted navigations
+                        # stop loading without a load event
+                        session.loaded.set()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            # Nothing will answer the commands still in flight
+            for future in session.pending.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("DevTools connection closed"))
+
+    async def _call(self, method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Send a command to the current page and wait for its response"""
+        return await self._send(self._session, method, params)
+
+    async def _send(self, session: CdpConnection, method: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Send a command over a connection; its reader task resolves the response"""
+        command_id = self.id_manager.next_id()
+        future = asyncio.get_running_loop().create_future()
+        session.pending[command_id] = future
+        try:
+            if params is None and method in _CDP_TEMPLATES:
+                message = _CDP_TEMPLATES[method] % command_id
+            else:
+                # Sent as text; DevTools doesn't accept binary frames
+                message = orjson.dumps({
+                    "id": command_id,
+                    "method": method,
+                    "params": params or {}
+                }).decode()
+            await session.ws.send(message)
+            response_data = await future
+        finally:
+            session.pending.pop(command_id, None)
+
+        if 'error' in response_data:
+            raise Exception(f"Failed in {method}: {response_data['error']}")
+        return response_data
+
+    async def _ensure_domain(self, domain: str):
+        """Enable a CDP domain on the current page, unless it already is"""
+        session = self._session
+        if domain not in session.enabled_domains:
+            response = await self._call(f"{domain}.enable")
+            logger.debug(f"{domain} domain enabled: {response}")
+            session.enabled_domains.add(domain)
+
+    async def new_session(self):
+        """Replace the pooled pages with fresh ones and close the old pages along with their browser contexts"""
+        # Responses are matched to commands by id, so pages are opened and
+        # closed concurrently over the one browser connection
+        results = await asyncio.gather(
+            *(self._open_page() for _ in range(self.pool_size)),
+            return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            # Keep serving from the old pages and drop the new ones that did open
+            await asyncio.gather(
+                *(self._close_page(r) for r in results if isinstance(r, PageSession)),
+                return_exceptions=True)
+            raise errors[0]
+
+        # Only swap once every new page is ready, so the pool is never left empty
+        old_sessions = self._sessions
+        while not self._pool.empty():
+            self._pool.get_nowait()
+        self._sessions = list(results)
+        for session in self._sessions:
+            self._pool.put_nowait(session)
+
+        await asyncio.gather(*(self._close_page(session) for session in old_sessions))
+
+    async def _close_page(self, session: PageSession):
+        """Close a page and, if it has its own, its browser context"""
+        await session.ws.close()
+        if session.browser_context_id:
+            # Disposing the context also closes its pages
+            await self._browser_call("Target.disposeBrowserContext", {"browserContextId": session.browser_context_id})
+        else:
+            await self._browser_call("Target.closeTarget", {"targetId": session.target_id})
+
+    async def _open_page(self) -> PageSession:
+        """Create a page target, connect to it and enable the domains we use"""
+        try:
+            target_params = {"url": "about:blank"}
+            browser_context_id = None
+            if not self.extensions:
+                # Extensions only run in the default context, so only create
+                # a new context without them. A new context is much cheaper
+                # than relaunching the browser and can carry its own proxy
+                context_params = {}
+                if self.proxy_config and 'server' in self.proxy_config:
+                    context_params["proxyServer"] = self.proxy_config["server"]
+                response_data = await self._browser_call("Target.createBrowserContext", context_params)
+                browser_context_id = response_data["result"]["browserContextId"]
+                target_params["browserContextId"] = browser_context_id
+
+            response_data = await self._browser_call("Target.createTarget", target_params)
+            target_id = response_data["result"]["targetId"]
+
+            # Connect to the page
+            ws_url = f"ws://localhost:{self.debug_port}/devtools/page/{target_id}"
+            session = PageSession(
+                await websockets.connect(ws_url, **_CDP_WS_OPTIONS),
+                target_id, browser_context_id)
+            session.reader_task = asyncio.create_task(
+                self._reader_loop(session))
+            logger.info(f"Connected to page at {ws_url}")
+        except Exception as e:
+            logger.error(f"Failed to open page: {e}")
+            raise
+
+        token = self._active_session.set(session)
+        try:
+            # Enable necessary domains for the page, set the viewport size
+            # and send the initial handshake. The commands are independent,
+            # so they are all sent before waiting for any response
+            responses = await asyncio.gather(
+                self._ensure_domain("Page"),
+                self._ensure_domain("DOM"),
+                self._call("Emulation.setDeviceMetricsOverride", {
+                    **_VIEWPORT,
                     "deviceScaleFactor": 1,
                     "mobile": False
-                }
-            }))
-            response = await self.ws.recv()
-            print(f"Viewport set: {response}")
-
-            # Send initial handshake
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Browser.getVersion"
-            }))
-            response = await self.ws.recv()
-            print(f"Browser version: {response}")
+                }),
+                self._call("Browser.getVersion")
+            )
+            logger.debug(f"Page set up: {responses}")
 
             # If proxy authentication is configured, handle it
             if self.proxy_config and 'username' in self.proxy_config and 'password' in self.proxy_config:
                 await self._handle_proxy_auth()
 
+            return session
         except Exception as e:
-            print(f"Failed to connect to browser: {e}")
+            logger.error(f"Failed to open page: {e}")
             raise
+        finally:
+            self._active_session.reset(token)
 
     async def _handle_proxy_auth(self):
         """Handle proxy authentication if configured"""
         try:
             # Enable the Security domain
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Security.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Security domain enabled: {response}")
+            await self._ensure_domain("Security")
 
             # Set up proxy authentication
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Security.setOverrideCertificateErrors",
-                "params": {
-                    "override": True
-                }
-            }))
-            response = await self.ws.recv()
-            print(f"Certificate error override set: {response}")
+            response = await self._call("Security.setOverrideCertificateErrors", {
+                "override": True
+            })
+            logger.debug(f"Certificate error override set: {response}")
 
         except Exception as e:
-            print(f"Error handling proxy authentication: {e}")
+            logger.error(f"Error handling proxy authentication: {e}")
             raise
 
+    async def reconfigure(self, proxy_config: Optional[Dict[str, str]] = None, extensions: Optional[List[str]] = None):
+        """
+        Apply new proxy and extension settings, reusing the running browser when possible.
+
+        Args:
+            proxy_config: Dictionary containing proxy settings (e.g., {'server': 'http://proxy:port'})
+            extensions: List of paths to Chrome extensions to load
+        """
+        extensions = extensions or []
+        # Extensions (and the proxy used alongside them) are launch flags
+        needs_restart = extensions != self.extensions or (
+            extensions and proxy_config != self.proxy_config)
+
+        self.proxy_config = proxy_config
+        self.extensions = extensions
+
+        if needs_restart:
+            await self.stop()
+            await self.start()
+        else:
+            await self.new_session()
+
     async def stop(self):
         """Stop the browser instance"""
-        if self.ws:
-            await self.ws.close()
+        for session in self._sessions:
+            await session.ws.close()
+        if self.browser_connection:
+            await self.browser_connection.ws.close()
         if self.browser_process:
-            # Kill the browser process and its children
-            parent = psutil.Process(self.browser_process.pid)
-            for child in parent.children(recursive=True):
-                child.kill()
-            parent.kill()
+            # Waits for the browser to exit, so keep it off the event loop
+            await asyncio.to_thread(self._kill_browser)
+
+        self.browser_process = None
+        self.browser_connection = None
+        self._sessions = []
+        while not self._pool.empty():
+            self._pool.get_nowait()
+
+    def _kill_browser(self):
+        """Terminate the browser process and its children, killing them if they don't exit in time"""
+        process = self.browser_process
+        if self.system == "windows":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)],
+                           capture_output=True)
+            process.wait()
+            return
+
+        try:
+            # The browser leads its own process group, see _ensure_browser
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=self.SHUTDOWN_TIMEOUT)
+        except ProcessLookupError:
+            pass
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
 
     async def wait_for_load(self):
         """Wait for page load to complete"""
         try:
             # Enable page load events
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Page domain enable response in wait_for_load: {response}")
-
-            # Wait for frameStoppedLoading event
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.frameStoppedLoading"
-            }))
-            response = await self.ws.recv()
-            print(f"Frame stopped loading response: {response}")
-
-            # Additional wait to ensure JavaScript is loaded
-            await asyncio.sleep(1)
+            await self._ensure_domain("Page")
+
+            # Returns right away unless a navigation is in progress
+            await asyncio.wait_for(self._session.loaded.wait(), self.LOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Page did not load within {self.LOAD_TIMEOUT} seconds")
         except Exception as e:
-            print(f"Error waiting for page load: {e}")
+            logger.error(f"Error waiting for page load: {e}")
+
+    async def _wait_for_navigation(self):
+        """Wait for a navigation triggered by an input event, if one starts shortly"""
+        try:
+            await asyncio.wait_for(
+                self._session.navigation_started.wait(), self.NAVIGATION_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Not every click or Enter navigates
+            return
+        logger.info("Navigation started")
+
+        # Wait for navigation to complete
+        await self.wait_for_load()
+        logger.info("Navigation completed")
 
     async def goto(self, url: str):
         """Navigate to a URL"""
         try:
-            print(f"Navigating to {url}...")
+            logger.info(f"Navigating to {url}...")
 
             # First ensure Page domain is enabled
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Page domain enable response: {response}")
+            await self._ensure_domain("Page")
 
             # Get current page state
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.getNavigationHistory"
-            }))
-            response = await self.ws.recv()
-            print(f"Current navigation state: {response}")
-
-            # Navigate to URL
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.navigate",
-                "params": {"url": url}
-            }))
-            response = await self.ws.recv()
-            print(f"Navigation response: {response}")
-
-            # Wait for navigation to complete
-            await self.wait_for_load()
-            print("Navigation completed")
+            response = await self._call("Page.getNavigationHistory")
+            logger.debug(f"Current navigation state: {response}")
+
+            # Navigate to URL. The page counts as loading from now on, in
+            # case the response arrives before frameStartedLoading
+            session = self._session
+            session.loaded.clear()
+            try:
+                response = await self._call("Page.navigate", {"url": url})
+            except Exception:
+                session.loaded.set()
+                raise
+            logger.debug(f"Navigation response: {response}")
+
+            result = response["result"]
+            if "errorText" in result:
+                session.loaded.set()
+                raise Exception(f"Navigation to {url} failed: {result['errorText']}")
+            if "loaderId" not in result:
+                # Same-document navigation (e.g. to a #fragment); no load
+                # event will follow
+                session.loaded.set()
+            else:
+                # Wait for navigation to complete
+                await self.wait_for_load()
+            logger.info("Navigation completed")
         except Exception as e:
-            print(f"Error during navigation: {e}")
+            logger.error(f"Error during navigation: {e}")
             raise
 
-    async def _wait_for_response(self, command_id: int, command_name: str):
-        """Helper method to wait for a specific command response while handling events"""
-        while True:
-            response = await self.ws.recv()
-            response_data = json.loads(response)
-
-            # If this is an event (has 'method' field), skip it
-            if 'method' in response_data:
-                print(f"Skipping event: {response}")
-                continue
-
-            # If this is our response (has 'id' matching our request)
-            if response_data.get('id') == command_id:
-                print(f"{command_name} response: {response}")
-                if 'error' in response_data:
-                    raise Exception(
-                        f"Failed in {command_name}: {response_data['error']}")
-                return response_data
-
     async def _find_element(self, selector: str):
         """Helper method to find an element using a selector"""
-        # Get the document root node
-        await self.ws.send(json.dumps({
-            "id": self.id_manager.next_id(),
-            "method": "DOM.getDocument"
-        }))
-        response_data = await self._wait_for_response(self.id_manager._current_id, "Get document")
-        root_node_id = response_data["result"]["root"]["nodeId"]
+        session = self._session
+        cached = session.root_node_id is not None
+
+        # Get the document root node, unless it's cached
+        if not cached:
+            response_data = await self._call("DOM.getDocument")
+            session.root_node_id = response_data["result"]["root"]["nodeId"]
 
         # Find the element using DOM.querySelector
-        await self.ws.send(json.dumps({
-            "id": self.id_manager.next_id(),
-            "method": "DOM.querySelector",
-            "params": {
-                "nodeId": root_node_id,
+        try:
+            response_data = await self._call("DOM.querySelector", {
+                "nodeId": session.root_node_id,
                 "selector": selector
-            }
-        }))
-        response_data = await self._wait_for_response(self.id_manager._current_id, "Query selector")
+            })
+        except Exception:
+            if not cached:
+                raise
+            # The cached root went stale before we heard about it
+            session.root_node_id = None
+            return await self._find_element(selector)
         node_id = response_data["result"]["nodeId"]
         if not node_id:
             raise Exception(f"Element not found with selector: {selector}")
 
         return node_id
 
-    async def click(self, selector: str):
-        """Click an element using the given selector"""
+    async def _element_center(self, selector: str):
+        """Scroll an element into view and get the viewport coordinates of its center"""
+        response_data = await self._call("Runtime.evaluate", {
+            "expression": f"""
+                (function() {{
+                    const el = document.querySelector({orjson.dumps(selector).decode()});
+                    if (!el) return null;
+                    el.scrollIntoView({{block: 'center', inline: 'center'}});
+                    const rect = el.getBoundingClientRect();
+                    // Hidden elements (e.g. display: none) have no box to click
+                    if (rect.width === 0 && rect.height === 0) return null;
+                    return [rect.left + rect.width / 2, rect.top + rect.height / 2];
+                }})()
+            """,
+            "returnByValue": True
+        })
+        center = response_data["result"]["result"].get("value")
+        if not center:
+            raise Exception(f"Element not found or not visible with selector: {selector}")
+        return center
+
+    async def click(self, selector: str, physical: bool = False):
+        """
+        Click an element using the given selector.
+
+        Args:
+            selector: CSS selector of the element to click
+            physical: Locate the element through the DOM domain and move the
+                mouse onto it before clicking, for pages that react to hover.
+                Otherwise the element is located and scrolled into view with
+                a single script evaluation
+        """
         try:
-            print(f"Clicking element with selector: {selector}")
+            logger.info(f"Clicking element with selector: {selector}")
 
-            # Find the element
-            node_id = await self._find_element(selector)
+            if physical:
+                # Find the element
+                node_id = await self._find_element(selector)
 
-            # Get element's box model to determine click coordinates
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.getBoxModel",
-                "params": {
-                    "nodeId": node_id
-                }
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Box model")
-            box_model = response_data
+                # Get element's box model to determine click coordinates
+                box_model = await self._call("DOM.getBoxModel", {"nodeId": node_id})
 
-            # Calculate center point of the element
-            content = box_model["result"]["model"]["content"]
-            x = (content[0] + content[2]) / 2
-            y = (content[1] + content[5]) / 2
+                # Calculate center point of the element
+                content = box_model["result"]["model"]["content"]
+                x = (content[0] + content[2]) / 2
+                y = (content[1] + content[5]) / 2
+            else:
+                x, y = await self._element_center(selector)
+
+            # Only a navigation caused by the click matters below
+            self._session.navigation_started.clear()
 
             # Move mouse to element and click
             mouse_events = [
-                {"type": "mouseMoved", "id": self.id_manager.next_id()},
-                {"type": "mousePressed", "id": self.id_manager.next_id(),
-                    "button": "left", "clickCount": 1},
-                {"type": "mouseReleased", "id": self.id_manager.next_id(),
-                    "button": "left", "clickCount": 1}
+                {"type": "mousePressed", "button": "left", "clickCount": 1},
+                {"type": "mouseReleased", "button": "left", "clickCount": 1}
             ]
+            if physical:
+                mouse_events.insert(0, {"type": "mouseMoved"})
 
+            # Chrome acknowledges each event after dispatching it, so
+            # awaiting the responses already keeps them in order
             for event in mouse_events:
-                params = {
-                    "type": event["type"],
-                    "x": x,
-                    "y": y
-                }
-                if "button" in event:
-                    params["button"] = event["button"]
-                if "clickCount" in event:
-                    params["clickCount"] = event["clickCount"]
-
-                await self.ws.send(json.dumps({
-                    "id": event["id"],
-                    "method": "Input.dispatchMouseEvent",
-                    "params": params
-                }))
-                await self._wait_for_response(event["id"], f"Mouse {event['type']}")
-
-                # Add small delay between events
-                if event["type"] != "mouseReleased":
-                    await asyncio.sleep(0.1)
-
-            # Wait for navigation to start
-            while True:
-                response = await self.ws.recv()
-                response_data = json.loads(response)
-
-                if response_data.get("method") == "Page.frameStartedLoading":
-                    print("Navigation started")
-                    break
-                if "id" in response_data:
-                    print(f"Unexpected response: {response}")
-                    break
+                await self._call("Input.dispatchMouseEvent", {**event, "x": x, "y": y})
 
-            # Wait for navigation to complete
-            await self.wait_for_load()
-            print("Navigation completed")
+            await self._wait_for_navigation()
 
         except Exception as e:
-            print(f"Error clicking element: {e}")
+            logger.error(f"Error clicking element: {e}")
             raise
 
     async def press_key(self, params: dict, press_type: str):
         # Send keyDown event
-        await self.ws.send(json.dumps({
-            "id": self.id_manager.next_id(),
-            "method": "Input.dispatchKeyEvent",
-            "params": {
-                "type": press_type,
-                **params
-            }
-        }))
-        await self._wait_for_response(self.id_manager._current_id, f"Key press")
+        await self._call("Input.dispatchKeyEvent", {
+            "type": press_type,
+            **params
+        })
 
     async def keyboard_press(self, key: str):
         """Simulate pressing a key using Playwright-style API"""
@@ -488,336 +917,304 @@ class BrowserAgent:
         # Get key parameters
         params = key_mapping.get(key, {'text': key})
 
+        if key == 'Enter':
+            self._session.navigation_started.clear()
+
         await self.press_key(params, "keyDown")
         await self.press_key(params, "keyUp")
 
         # Add a small delay between key events
         await asyncio.sleep(0.05)
         if key == 'Enter':
-            await self.wait_for_load()
+            await self._wait_for_navigation()
 
     async def fill(self, selector: str, text: str):
         """Fill text into an input element using the given selector"""
         try:
-            print(f"Filling text into element with selector: {selector}")
+            logger.info(f"Filling text into element with selector: {selector}")
 
             # Find the element
             node_id = await self._find_element(selector)
 
-            # Focus the element
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.focus",
-                "params": {
-                    "nodeId": node_id
-                }
-            }))
-            await self._wait_for_response(self.id_manager._current_id, "Focus element")
-
-            # Type the new text
-            for i, char in enumerate(text):
-                await self.keyboard_press(char)
-                await asyncio.sleep(0.05)
+            # Focus the element, then insert the whole text in one command.
+            # The focus must succeed first, or the text would go into
+            # whichever element already has focus
+            await self._call("DOM.focus", {"nodeId": node_id})
+            await self._call("Input.insertText", {"text": text})
 
-            print(f"Successfully filled text: {text}")
+            # The text may be a password, so it isn't logged
+            logger.debug(f"Successfully filled {len(text)} characters")
 
         except Exception as e:
-            print(f"Error filling text: {e}")
+            logger.error(f"Error filling text: {e}")
             raise
 
     async def clear_text(self, selector: str):
         """Clear text from an input element using the given selector"""
         try:
-            print(f"Clearing text from element with selector: {selector}")
+            logger.info(f"Clearing text from element with selector: {selector}")
 
             # Find the element
             node_id = await self._find_element(selector)
 
-            # Focus the element
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.focus",
-                "params": {
-                    "nodeId": node_id
-                }
-            }))
-            await self._wait_for_response(self.id_manager._current_id, "Focus element")
-
-            # First ensure Runtime domain is enabled
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Runtime.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Runtime enable response: {response}")
-
-            # Construct JavaScript to clear the input value
-            js_script = f"""
-                (function() {{
-                    const element = document.querySelector('{selector}');
-                    if (!element) return false;
-                    element.value = '';
-                    // Trigger input event to ensure the change is registered
-                    element.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                    return true;
-                }})()
-            """
-
-            # Send evaluation request
-            cmd_id = self.id_manager.next_id()
-            await self.ws.send(json.dumps({
-                "id": cmd_id,
-                "method": "Runtime.evaluate",
-                "params": {
-                    "expression": js_script,
-                    "returnByValue": True
-                }
-            }))
-
-            # Wait for the response
-            while True:
-                response = await self.ws.recv()
-                response_data = json.loads(response)
-                print(f"Received response: {response_data}")
-
-                # Skip any event messages
-                if 'method' in response_data:
-                    continue
+            # Focus the element and get a handle to it for the script
+            _, response_data = await asyncio.gather(
+                self._call("DOM.focus", {"nodeId": node_id}),
+                self._call("DOM.resolveNode", {"nodeId": node_id})
+            )
 
-                # If this is our response
-                if response_data.get('id') == cmd_id:
-                    if "error" in response_data:
-                        raise Exception(
-                            f"Failed to clear text: {response_data['error']}")
+            # Clear the value of the element we already found, rather than
+            # querying the selector again from a script
+            response_data = await self._call("Runtime.callFunctionOn", {
+                "functionDeclaration": _CLEAR_VALUE_FUNCTION,
+                "objectId": response_data["result"]["object"]["objectId"],
+                "returnByValue": True
+            })
+            logger.debug(f"Received response: {response_data}")
 
-                    result = response_data.get("result", {}).get(
-                        "result", {}).get("value", False)
-                    if not result:
-                        raise Exception(
-                            f"Element not found with selector: {selector}")
+            result = response_data.get("result", {}).get(
+                "result", {}).get("value", False)
+            if not result:
+                raise Exception(
+                    f"Element not found with selector: {selector}")
 
-                    print("Successfully cleared text")
-                    return
+            logger.debug("Successfully cleared text")
 
         except Exception as e:
-            print(f"Error clearing text: {e}")
+            logger.error(f"Error clearing text: {e}")
             raise
 
-    async def screenshot(self, path: str = None):
-        """Take a screenshot of the page"""
+    async def screenshot(self, path: str = None, format: str = "webp", quality: int = 55):
+        """
+        Take a screenshot of the visible part of the page.
+
+        Returns the image as a data URL, which OpenAI accepts as is.
+
+        Args:
+            path: File to also write the image to
+            format: Image format, "webp", "jpeg" or "png"
+            quality: Compression quality for webp and jpeg (0-100)
+        """
         try:
-            print("Taking screenshot...")
+            logger.debug("Taking screenshot...")
 
             # Get the viewport size
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.getLayoutMetrics"
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Get layout metrics")
+            response_data = await self._call("Page.getLayoutMetrics")
             metrics = response_data["result"]
 
-            # Use CSS viewport for consistent sizing
-            viewport = metrics["cssLayoutViewport"]
-
-            # Always use viewport dimensions for consistent window size
-            width = viewport["clientWidth"]
-            height = viewport["clientHeight"]
-
-            # Capture screenshot
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.captureScreenshot",
-                "params": {
-                    "format": "png",
-                    "fromSurface": True,
-                    "clip": {
-                        "x": 0,
-                        "y": 0,
-                        "width": width,
-                        "height": height,
-                        "scale": 1.0
-                    }
+            # Use the CSS visual viewport, i.e. what a user would see at the
+            # current scroll position, for consistent sizing
+            viewport = metrics["cssVisualViewport"]
+
+            # Let Chrome scale the capture so its longer side fits the size
+            # OpenAI uses, instead of decoding and resizing it here
+            scale = min(1, _SCREENSHOT_SIZE /
+                        max(viewport["clientWidth"], viewport["clientHeight"]))
+            params = {
+                "format": format,
+                "fromSurface": True,
+                "captureBeyondViewport": False,
+                "clip": {
+                    "x": viewport["pageX"],
+                    "y": viewport["pageY"],
+                    "width": viewport["clientWidth"],
+                    "height": viewport["clientHeight"],
+                    "scale": scale
                 }
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Capture screenshot")
-
-            # Save to file if path is provided
+            }
+            if format != "png":
+                params["quality"] = quality
+            response_data = await self._call("Page.captureScreenshot", params)
+
+            # Chrome already returns base64, which is only ever decoded for
+            # the file. Save to file if path is provided, off the event loop
+            # so other pages' CDP traffic isn't held up by the decode and
+            # disk write
+            data = response_data["result"]["data"]
             if path:
-                # Decode base64 image data
-                image_data = base64.b64decode(response_data["result"]["data"])
-                with open(path, 'wb') as f:
-                    f.write(image_data)
-                print(f"Screenshot saved to {path}")
+                await asyncio.to_thread(_save_base64, path, data)
+                logger.debug(f"Screenshot saved to {path}")
 
-            return response_data["result"]["data"]
+            return f"data:image/{format};base64,{data}"
 
         except Exception as e:
-            print(f"Error taking screenshot: {e}")
+            logger.error(f"Error taking screenshot: {e}")
             raise
 
     async def url(self) -> str:
         """Get the current page URL"""
         try:
-            print("Getting current URL...")
-
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Page.getNavigationHistory"
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Get navigation history")
+            logger.debug("Getting current URL...")
 
-            # Get the current entry's URL
-            current_entry = response_data["result"]["entries"][-1]
-            url = current_entry["url"]
-            print(f"Current URL: {url}")
+            # One evaluation instead of fetching the whole navigation history
+            response_data = await self._call("Runtime.evaluate", {
+                "expression": "location.href",
+                "returnByValue": True
+            })
+            url = response_data["result"]["result"]["value"]
+            logger.debug(f"Current URL: {url}")
 
             return url
 
         except Exception as e:
-            print(f"Error getting URL: {e}")
+            logger.error(f"Error getting URL: {e}")
             return "No URL found"
 
     async def title(self) -> str:
         """Get the current page title"""
         try:
-            print("Getting page title...")
-
-            # Get the document root node
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.getDocument"
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Get document")
-            root_node_id = response_data["result"]["root"]["nodeId"]
-
-            # Find the title element
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.querySelector",
-                "params": {
-                    "nodeId": root_node_id,
-                    "selector": "title"
-                }
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Query title element")
-            title_node_id = response_data["result"]["nodeId"]
-
-            if not title_node_id:
-                raise Exception("Title element not found")
-
-            # Get the title text
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "DOM.getOuterHTML",
-                "params": {
-                    "nodeId": title_node_id
-                }
-            }))
-            response_data = await self._wait_for_response(self.id_manager._current_id, "Get title text")
+            logger.debug("Getting page title...")
 
-            # Extract text from HTML
-            title_html = response_data["result"]["outerHTML"]
-            title = title_html.replace("<title>", "").replace("</title>", "")
-            print(f"Page title: {title}")
+            # One evaluation instead of finding the title element and
+            # stripping its tags
+            response_data = await self._call("Runtime.evaluate", {
+                "expression": "document.title",
+                "returnByValue": True
+            })
+            title = response_data["result"]["result"]["value"]
+            logger.debug(f"Page title: {title}")
 
-            return title
+            return title or "No title found"
 
         except Exception as e:
-            print(f"Error getting title: {e}")
+            logger.error(f"Error getting title: {e}")
             return "No title found"
 
     async def get_page_info(self, extract_data: str | None = None) -> Dict[str, Any]:
         """Gather information about the current page state with screenshot."""
         try:
-            # Get the current URL and title
-            current_url = await self.url()
-            title = await self.title()
-
-            # Take a screenshot
-            if not os.path.exists("screenshots"):
-                os.makedirs("screenshots")
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"screenshots/screenshot_{timestamp}.png"
-            screenshot_base64 = await self.screenshot(path=filename)
-
-            data = None
-            if extract_data:
-                extract_result = await self.extract(extract_data)
-                if extract_result["status"] == "success":
-                    data = extract_result["data"][:50]
+            # Only keep a copy of the screenshot on disk when debugging
+            filename = None
+            if self.screenshot_dir:
+                timestamp = time.strftime("%Y%m%d_%H%M%S")
+                filename = os.path.join(
+                    self.screenshot_dir, f"screenshot_{timestamp}.webp")
+
+            # Get the current URL, title and a screenshot. The CDP commands
+            # are independent, so keep them in flight together
+            current_url, title, screenshot = await asyncio.gather(
+                self.url(),
+                self.title(),
+                self.screenshot(path=filename)
+            )
 
-            return {
+            page_info = {
                 "url": current_url,
                 "title": title,
-                "screenshot": screenshot_base64,
-                "data": data
+                "screenshot": screenshot,
+                "data": None
             }
+
+            if extract_data:
+                # The page hasn't changed, so the extraction can reuse this
+                # information rather than gathering it all again
+                extract_result = await self.extract(extract_data, page_info)
+                if extract_result["status"] == "success":
+                    page_info["data"] = extract_result["data"][:50]
+
+            return page_info
         except Exception as e:
             return {"error": str(e)}
 
+    def _add_turn(self, messages: List[Dict[str, Any]], role: str, content: str):
+        """Record a turn in both the chat history and the in-flight OpenAI messages"""
+        message = {"role": role, "content": content}
+        self.chat_history.append(message)
+        messages.append(message)
+
     async def execute_command(self, command: str) -> Dict[str, Any]:
+        """Run a natural language command on a page from the pool"""
+        async with self._page():
+            return await self._execute_command(command)
+
+    async def _do_no_action(self, params: Dict[str, Any]):
+        pass
+
+    async def _do_navigate(self, params: Dict[str, Any]):
+        await self.goto(params["url"])
+
+    async def _do_click(self, params: Dict[str, Any]):
+        await self.click(params["selector"])
+
+    async def _do_type(self, params: Dict[str, Any]):
+        await self.fill(params["selector"], params["text"])
+
+    async def _do_search(self, params: Dict[str, Any]):
+        await self.goto(params["url"])
+        await self.fill(params["selector"], params["text"])
+
+        # Try both Enter key and submit button if available
+        try:
+            await self.click(params["submit_selector"])
+        except Exception as e:
+            await self.keyboard_press('Enter')
+
+    async def _do_login(self, params: Dict[str, Any]):
+        await self.goto(params["url"])
+        await self.fill(params["username_selector"], params["username"])
+        await self.fill(params["password_selector"], params["password"])
+        try:
+            await self.click(params["submit_selector"])
+        except Exception as e:
+            await self.keyboard_press('Enter')
+
+    async def _run_action(self, action: str, params: Dict[str, Any]):
+        """Perform a single browser action requested by the model"""
+        handler = self._actions.get(action)
+        if handler is None:
+            raise Exception(f"Unknown action: {action}")
+        await handler(params)
+
+    def _history_key(self, command: str) -> str:
+        """Hash of the last chat message before a command, or "" if there is none"""
+        history = self.chat_history
+        # Chat callers add the command to the history before running it; the
+        # command itself is matched by the cache, so it is left out here
+        index = len(history) - 1
+        if (index >= 0 and history[index].get("role") == "user"
+                and history[index].get("content") == command):
+            index -= 1
+        if index < 0:
+            return ""
+        last = history[index]
+        return hashlib.sha1(orjson.dumps(
+            [last.get("role"), last.get("content")])).hexdigest()
+
+    async def _execute_command(self, command: str) -> Dict[str, Any]:
         try:
-            page_info = None
+            page_info_task = None
             run_agent = True
             max_iterations = 10
             iteration = 0
 
+            # Build the stable part of the conversation once; every iteration
+            # only appends its new turns to it
+            messages = [
+                {"role": "system", "content": _EXECUTE_SYSTEM_PROMPT},
+                {"role": "user", "content": command}
+            ]
+
+            # Keep last 10 messages for context
+            recent = reversed(list(itertools.islice(reversed(self.chat_history), 10)))
+            for msg in recent:
+                # Ensure content is a string
+                content = msg.get("content", None)
+                if isinstance(content, (dict, list)):
+                    content = orjson.dumps(content).decode()
+
+                if content is not None:
+                    messages.append({
+                        "role": msg["role"],
+                        "content": content
+                    })
+
             while iteration < max_iterations and run_agent:
                 iteration += 1
 
-                # Prepare messages for OpenAI
-                messages = [
-                    {
-                        "role": "system",
-                        "content": """
-                        You are a browser automation assistant. Parse the user's command into a json format. You are allowed to perform an action and then request to see the page information before proceeding. Set the needs_page_info to true if you need to see the page information after performing the action before proceeding to take the next action. Your response should be parsable using Python's json.loads function.
-                        The json should have the following fields:
-                        - action: The action to perform. The action should be one of the following:
-                            - no_action: Do nothing. Use it if you only need to see the page information screenshot.
-                            - navigate: Navigate to the url, where the "url" is the key in the json. The value of the key will be the input to the goto function of playwright.
-                            - click: Click on the element, where the "selector" is the key in the json. The value of the key will be the input to the click function of playwright.
-                            - type: Type the text, where the "selector" and "text" are the keys in the json. The values of the keys will be the input to the fill function of playwright.
-                            - search: Search for the query. For this we will have the following keys in the json. 
-                                - url: The url to navigate to.  The value of the key will be the input to the goto function of playwright.
-                                - selector: Click on the element. The value of the key will be the input to the fill function of playwright.
-                                - text: The text to type. The value of the key will be the input to the fill function of playwright.
-                                - submit_selector: The selector for the login/submit button
-                            - login: Perform login action. For this we will have the following keys in the json:
-                                - url: The login page URL
-                                - username_selector: The selector for the username/email field
-                                - password_selector: The selector for the password field
-                                - username: The username/email to enter
-                                - password: The password to enter
-                                - submit_selector: The selector for the login/submit button
-                        - needs_page_info: A boolean indicating whether you need to see the current page state before proceeding. If the user command has been executed, set this to false. Only set this to true if the user command has not been executed, confirm this from the screenshot.
-                        - extract_data: If needs_page_info is true, then you need to extract data from the page. Give a natural language description of the data you need to extract, this will be passed to another AI agent to extract the data based on the selector and attribute. This is required if needs_page_info is true.
-
-                        Extra Information:
-                        - If you are trying to input something at google.com then the selector is 'textarea[name="q"]'
-                        """
-                    }
-                ]
-
-                # Add the user's command
-                messages.append({"role": "user", "content": command})
-
-                # Keep last 10 messages for context
-                for msg in self.chat_history[-10:]:
-                    # Ensure content is a string
-                    content = msg.get("content", None)
-                    if isinstance(content, dict):
-                        content = json.dumps(content)
-                    elif isinstance(content, list):
-                        content = json.dumps(content)
-
-                    if content is not None:
-                        messages.append({
-                            "role": msg["role"],
-                            "content": content
-                        })
-
-                # Add page information if provided
-                if page_info:
+                # Add page information if requested
+                if page_info_task:
+                    page_info = await page_info_task
+                    page_info_task = None
                     messages.append({
                         "role": "user",
                         "content": [
@@ -829,227 +1226,267 @@ class BrowserAgent:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{page_info['screenshot']}",
+                                    "url": page_info["screenshot"],
                                     "detail": "low"
                                 }
                             }
                         ]
                     })
 
-                # Get response from OpenAI
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages
-                )
-                self.chat_history.append({
+                # The first plan is made before seeing the page, so a
+                # near-identical command from the same URL gets the same one.
+                # The plan also depends on the chat so far, so the scope
+                # includes the message before the command too
+                cached = None
+                if iteration == 1:
+                    url, cache_vector = await asyncio.gather(
+                        self.url(), self.command_cache.embed(command))
+                    cache_scope = f"{url} {self._history_key(command)}"
+                    cached = self.command_cache.get(cache_vector, cache_scope)
+
+                if cached:
+                    message = ChatCompletionMessage.model_validate(cached)
+                else:
+                    # Get the next actions from OpenAI. A single response can
+                    # carry a whole plan as several tool calls
+                    response = await self.client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        tools=_BROWSER_TOOLS,
+                        tool_choice="auto"
+                    )
+                    message = response.choices[0].message
+
+                # No tool call means the model considers the command done
+                if not message.tool_calls:
+                    logger.debug(f"Raw response: {message.content}")
+                    self._add_turn(messages, "assistant",
+                                   (message.content or "").strip())
+                    break
+
+                messages.append({
                     "role": "assistant",
-                    "content": response.choices[0].message.content.strip()
+                    "content": message.content,
+                    "tool_calls": [
+                        {
+                            "id": tool_call.id,
+                            "type": "function",
+                            "function": {
+                                "name": tool_call.function.name,
+                                "arguments": tool_call.function.arguments
+                            }
+                        }
+                        for tool_call in message.tool_calls
+                    ]
                 })
 
-                # Parse the response content
-                try:
-                    content = response.choices[0].message.content.strip()
-                    print("Raw response:", content)  # Debug print
-                    parsed_command = json.loads(content)
-                except json.JSONDecodeError as e:
-                    print(f"JSON parsing error: {str(e)}")
-                    print(f"Invalid JSON content: {content}")
-                    self.chat_history.append({
-                        "role": "user",
-                        "content": f"Failed to parse AI response: {str(e)}"
-                    })
-                    continue
-
-                # Execute the parsed command
-                try:
-                    if parsed_command["action"] == "navigate":
-                        await self.goto(parsed_command["url"])
-                    elif parsed_command["action"] == "click":
-                        await self.click(parsed_command["selector"])
-                    elif parsed_command["action"] == "type":
-                        await self.fill(parsed_command["selector"], parsed_command["text"])
-                    elif parsed_command["action"] == "search":
-                        await self.goto(parsed_command["url"])
-                        await self.fill(parsed_command["selector"], parsed_command["text"])
-
-                        # Try both Enter key and submit button if available
-                        try:
-                            await self.click(parsed_command["submit_selector"])
-                        except Exception as e:
-                            await self.keyboard_press('Enter')
-                    elif parsed_command["action"] == "login":
-                        await self.goto(parsed_command["url"])
-                        await self.fill(parsed_command["username_selector"], parsed_command["username"])
-                        await self.fill(parsed_command["password_selector"], parsed_command["password"])
+                # Execute the requested actions in order. Every tool call
+                # needs a tool message in reply, even after a failure
+                actions = []
+                error = None
+                extract_data = None
+                run_agent = False
+                for tool_call in message.tool_calls:
+                    if error:
+                        result = "Skipped because an earlier action failed"
+                    else:
                         try:
-                            await self.click(parsed_command["submit_selector"])
+                            params = orjson.loads(tool_call.function.arguments)
+                            actions.append(
+                                {"action": tool_call.function.name, **params})
+                            logger.info(f"Running action: {tool_call.function.name}")
+                            # Never write credentials to the log
+                            logged = {**params, "password": "***"} if "password" in params else params
+                            logger.debug(f"Action parameters: {logged}")
+                            await self._run_action(tool_call.function.name, params)
+                            result = "Done"
+                            if params.get("needs_page_info"):
+                                run_agent = True
+                                extract_data = params.get("extract_data")
                         except Exception as e:
-                            await self.keyboard_press('Enter')
-                    await self.keyboard_press('Enter')
+                            logger.error(f"Command execution error: {str(e)}")
+                            error = f"Failed to execute command: {str(e)}"
+                            result = error
 
-                except Exception as e:
-                    print(f"Command execution error: {str(e)}")
-                    self.chat_history.append({
-                        "role": "user",
-                        "content": f"Failed to execute command: {str(e)}"
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call.id,
+                        "content": result
                     })
+
+                # Start capturing the page now so it overlaps the bookkeeping
+                # below; it is awaited when the next request is built
+                if run_agent and not error:
+                    page_info_task = asyncio.create_task(
+                        self.get_page_info(extract_data))
+
+                self.chat_history.append({
+                    "role": "assistant",
+                    "content": orjson.dumps(actions).decode()
+                })
+
+                if iteration == 1 and not cached and not error:
+                    self.command_cache.put(
+                        cache_vector, message.model_dump(), cache_scope)
+
+                if error:
+                    # Let the model re-plan with the error in context
+                    self.chat_history.append({"role": "user", "content": error})
+                    run_agent = True
                     continue
 
-                # Check if we need page information
-                if parsed_command["needs_page_info"]:
-                    page_info = await self.get_page_info(parsed_command.get("extract_data", None))
-                else:
-                    run_agent = False
+            if page_info_task:
+                # Out of iterations; nothing will look at the page
+                page_info_task.cancel()
 
             return {
                 "status": "success",
                 "message": f"Executed command: {command}",
-                "chat_history": self.chat_history
+                "chat_history": list(self.chat_history)
             }
 
         except Exception as e:
-            print(f"General error: {str(e)}")
+            logger.error(f"General error: {str(e)}")
             return {"status": "error", "message": str(e)}
 
     async def extract_data(self, selector: str, attribute: str | None = None, multiple: bool = False):
         try:
-            print(
+            logger.info(
                 f"Extracting data with selector: {selector}, attribute: {attribute}, multiple: {multiple}")
 
-            # First ensure Runtime domain is enabled
-            await self.ws.send(json.dumps({
-                "id": self.id_manager.next_id(),
-                "method": "Runtime.enable"
-            }))
-            response = await self.ws.recv()
-            print(f"Runtime enable response: {response}")
+            # Runtime.evaluate works without enabling the Runtime domain, which
+            # would only add console and execution context events to read
 
-            # Construct JavaScript expression
+            # Construct JavaScript expression. The selector and attribute are
+            # embedded as JSON string literals, so quotes in them can't break
+            # the script
+            value = (f"el.getAttribute({orjson.dumps(attribute).decode()})"
+                     if attribute else "el.textContent")
             if multiple:
                 js_script = f"""
-                    JSON.stringify(Array.from(document.querySelectorAll('{selector}')).map(el => {{
-                        return {f"el.getAttribute('{attribute}')" if attribute else "el.textContent"};
-                    }}))
+                    Array.from(document.querySelectorAll({orjson.dumps(selector).decode()})).map(el => {{
+                        return {value};
+                    }})
                 """
             else:
                 js_script = f"""
-                    JSON.stringify((() => {{
-                        const el = document.querySelector('{selector}');
+                    (() => {{
+                        const el = document.querySelector({orjson.dumps(selector).decode()});
                         if (!el) return null;
-                        return {f"el.getAttribute('{attribute}')" if attribute else "el.textContent"};
-                    }})())
+                        return {value};
+                    }})()
                 """
 
-            print(f"Executing JavaScript: {js_script}")
+            logger.debug(f"Executing JavaScript: {js_script}")
 
             # Send evaluation request
-            cmd_id = self.id_manager.next_id()
-            await self.ws.send(json.dumps({
-                "id": cmd_id,
-                "method": "Runtime.evaluate",
-                "params": {
-                    "expression": js_script,
-                    "returnByValue": True
-                }
-            }))
-
-            # Wait for the specific response with our command ID
-            while True:
-                response = await self.ws.recv()
-                response_data = json.loads(response)
-                print(f"Received response: {response_data}")
+            response_data = await self._call("Runtime.evaluate", {
+                "expression": js_script,
+                "returnByValue": True
+            })
+            logger.debug(f"Received response: {response_data}")
+
+            if "exceptionDetails" in response_data["result"]:
+                # e.g. an invalid selector
+                details = response_data["result"]["exceptionDetails"]
+                message = details.get("exception", {}).get("description", details.get("text"))
+                return {"status": "error", "message": f"Script failed: {message}"}
 
-                # Skip any event messages
-                if 'method' in response_data:
-                    continue
-
-                # If this is our response
-                if response_data.get('id') == cmd_id:
-                    if "error" in response_data:
-                        return {"status": "error", "message": str(response_data["error"])}
-
-                    try:
-                        result = json.loads(
-                            response_data["result"]["result"]["value"])
-                        if result is None:
-                            return {"status": "error", "message": "Element not found"}
-                        return {"status": "success", "data": result}
-                    except (KeyError, json.JSONDecodeError) as e:
-                        print(f"Error parsing result: {e}")
-                        return {"status": "error", "message": f"Failed to parse result: {str(e)}"}
-                    break
+            try:
+                # returnByValue already sends the result back as JSON
+                result = response_data["result"]["result"]["value"]
+                if result is None:
+                    return {"status": "error", "message": "Element not found"}
+                return {"status": "success", "data": result}
+            except KeyError as e:
+                logger.error(f"Error parsing result: {e}")
+                return {"status": "error", "message": f"Failed to parse result: {str(e)}"}
 
         except Exception as e:
-            print(f"Error in extract_data: {str(e)}")
+            logger.error(f"Error in extract_data: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-    async def extract(self, query: str) -> Dict[str, Any]:
-        try:
-            # Get current page information
-            page_info = await self.get_page_info()
-
-            # Prepare messages for OpenAI
-            messages = [
-                {
-                    "role": "system",
-                    "content": """
-                    You are a web scraping assistant. Your task is to determine the best CSS selector and attribute to extract data from a webpage based on a natural language query. Your response should be parsable using Python's json.loads function without any additional formatting.
-                    
-                    The json should have the following fields:
-                    - selector: The CSS selector to use
-                    - attribute: The attribute to extract (optional, if not provided, text content will be extracted)
-                    - multiple: Boolean indicating whether to get all matching elements or just the first one
-                    - explanation: A brief explanation of why these parameters were chosen
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Current URL: {page_info['url']}\nCurrent Title: {page_info['title']}\n\nQuery: {query}"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{page_info['screenshot']}",
-                                "detail": "low"
-                            }
-                        }
-                    ]
-                }
-            ]
-
-            # Get response from OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages
-            )
-
-            # Parse the response
-            try:
-                print(response.choices[0].message.content.strip())
-                extraction_params = json.loads(
-                    response.choices[0].message.content.strip())
-            except json.JSONDecodeError as e:
-                return {
-                    "status": "error",
-                    "message": f"Failed to parse AI response: {str(e)}"
-                }
-
-            # Extract data using the determined parameters
-            result = await self.extract_data(
-                selector=extraction_params["selector"],
-                attribute=extraction_params.get("attribute"),
-                multiple=extraction_params.get("multiple", False)
-            )
+    async def extract(self, query: str, page_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Extract data from a page from the pool based on a natural language query"""
+        async with self._page():
+            return await self._extract(query, page_info)
 
-            # Add explanation to the result
+    async def _extract(self, query: str, page_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            # Reuse the parameters chosen for a near-identical query on the
+            # same page, which also spares the screenshot
+            url = page_info["url"] if page_info else await self.url()
+            cache_vector = await self.extract_cache.embed(query)
+            extraction_params = self.extract_cache.get(cache_vector, url)
+
+            if extraction_params is not None:
+                result = await self._extract_with(extraction_params)
+                if result["status"] == "success":
+                    return result
+                # The page changed under the same URL; ask the model again
+                logger.info("Cached extraction parameters failed, choosing new ones")
+                self.extract_cache.discard(cache_vector, url)
+
+            # Get current page information, unless the caller already has it
+            if page_info is None:
+                page_info = await self.get_page_info()
+            extraction_params = await self._choose_extraction_params(query, page_info)
+
+            result = await self._extract_with(extraction_params)
             if result["status"] == "success":
-                result["explanation"] = extraction_params["explanation"]
-
+                self.extract_cache.put(cache_vector, extraction_params, url)
             return result
 
         except Exception as e:
-            print(f"Error in extract: {str(e)}")
+            logger.error(f"Error in extract: {str(e)}")
             return {"status": "error", "message": str(e)}
+
+    async def _extract_with(self, extraction_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract data using the parameters chosen for a query"""
+        result = await self.extract_data(
+            selector=extraction_params["selector"],
+            attribute=extraction_params.get("attribute"),
+            multiple=extraction_params.get("multiple", False)
+        )
+
+        # Add explanation to the result
+        if result["status"] == "success":
+            result["explanation"] = extraction_params.get("explanation")
+        return result
+
+    async def _choose_extraction_params(self, query: str, page_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask OpenAI for the selector and attribute that answer an extraction query"""
+        # Prepare messages for OpenAI
+        messages = [
+            {"role": "system", "content": _EXTRACT_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"Current URL: {page_info['url']}\nCurrent Title: {page_info['title']}\n\nQuery: {query}"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": page_info["screenshot"],
+                            "detail": "low"
+                        }
+                    }
+                ]
+            }
+        ]
+
+        # Get response from OpenAI, constrained to valid JSON
+        response = await self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            response_format={"type": "json_object"}
+        )
+
+        # Parse the response
+        try:
+            logger.debug(response.choices[0].message.content.strip())
+            return orjson.loads(response.choices[0].message.content.strip())
+        except orjson.JSONDecodeError as e:
+            raise Exception(f"Failed to parse AI response: {str(e)}")
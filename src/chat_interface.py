@@ -1,11 +1,15 @@
 from fastapi import APIRouter, WebSocket, HTTPException, WebSocketDisconnect
-from pymongo import MongoClient
-from typing import List, Dict, Any
-import json
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from typing import List, Dict, Any, Optional
+import orjson
 import os
+import re
 from datetime import datetime
 import logging
 from src.browser_agent import BrowserAgent
+from src.semantic_cache import SemanticCache
+from src.embedding_cache import embedding_cache
 
 
 # Set up logging
@@ -15,21 +19,47 @@ logger = logging.getLogger(__name__)
 # Create router instead of FastAPI app
 router = APIRouter()
 
+# Chat IDs are creation timestamps, see ChatManager.create_chat. Older chats
+# have IDs without the microseconds
+CHAT_ID_RE = re.compile(r"\d{8}_\d{6}(?:_\d{6})?")
+# Attempts at creating a chat whose ID is not taken yet
+CREATE_CHAT_ATTEMPTS = 3
+
+# System prompt for process_message. It is kept byte-for-byte identical across
+# calls so that OpenAI can reuse the cached prompt prefix
+_DECISION_SYSTEM_PROMPT = """
+You are a browser automation assistant. Analyze the user's message and determine whether to:
+1. Execute a browser action (using the execute_command API)
+2. Extract data from the current page (using the extract API)
+
+Respond with a JSON object containing:
+{
+    "action_type": "execute" or "extract",
+    "command": "the command to execute" or "the data to extract"; the command will be passed to another AI model to generate a json,
+    "explanation": "brief explanation of your decision"
+}
+"""
+
 # MongoDB connection with error handling
 mongodb_available = False
 try:
     MONGODB_URL = os.getenv("MONGODB_URL")
-    logger.info(f"Attempting to connect to MongoDB at {MONGODB_URL}")
-    client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
-    # Verify connection
-    client.server_info()
+    logger.info(f"Using MongoDB at {MONGODB_URL}")
+    # Connections are opened lazily by the first query and pooled, so the
+    # event loop is never blocked on the database
+    client = AsyncIOMotorClient(
+        MONGODB_URL,
+        serverSelectionTimeoutMS=5000,
+        maxPoolSize=50,
+        minPoolSize=5,
+        tz_aware=False
+    )
     db = client.browser_automation
     chat_collection = db.chats
     mongodb_available = True
-    logger.info("Successfully connected to MongoDB")
 except Exception as e:
-    logger.error(f"Error connecting to MongoDB: {str(e)}")
-    logger.error("Please ensure MongoDB is running and accessible")
+    logger.error(f"Error configuring MongoDB: {str(e)}")
+    logger.error("Please ensure MONGODB_URL is a valid connection string")
     client = None
     db = None
     chat_collection = None
@@ -37,18 +67,34 @@ except Exception as e:
 # Initialize browser agent
 browser_agent = BrowserAgent()
 
+# Decisions depend on nothing but the user message, so they are reused for
+# near-identical messages
+decision_cache = SemanticCache(browser_agent.client, threshold=0.95)
+
 
 def set_browser_agent(agent: BrowserAgent):
     """Set the browser agent instance"""
     global browser_agent
     browser_agent = agent
+    decision_cache.client = agent.client
 
 
 class ChatManager:
     def __init__(self):
         self.active_chats = {}
 
-    async def get_chat_history(self, chat_id: str) -> List[Dict[str, Any]]:
+    async def create_indexes(self):
+        """Index chats by ID so lookups don't scan the whole collection"""
+        if not mongodb_available:
+            return
+        try:
+            await chat_collection.create_index("chat_id", unique=True)
+        except Exception as e:
+            # Queries still work without the index, only slower
+            logger.error(f"Error creating chat index: {str(e)}")
+
+    async def get_chat_history(self, chat_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the messages of a chat, or only the last `limit` of them"""
         if not mongodb_available:
             logger.error("MongoDB connection not available")
             raise HTTPException(
@@ -56,11 +102,16 @@ class ChatManager:
                 detail="MongoDB is not available. Please ensure MongoDB is running."
             )
         try:
-            chat = chat_collection.find_one({"chat_id": chat_id})
+            # Let the server drop the messages that aren't needed
+            messages = {"$slice": -limit} if limit else 1
+            chat = await chat_collection.find_one(
+                {"chat_id": chat_id},
+                {"_id": 0, "messages": messages}
+            )
             if not chat:
                 logger.error(f"Chat not found: {chat_id}")
                 raise HTTPException(status_code=404, detail="Chat not found")
-            logger.info(f"Retrieved chat history for ID: {chat_id}")
+            logger.debug(f"Retrieved chat history for ID: {chat_id}")
             return chat.get("messages", [])
         except Exception as e:
             logger.error(f"Error getting chat history: {str(e)}")
@@ -69,7 +120,20 @@ class ChatManager:
                 detail="Database service unavailable"
             )
 
+    @staticmethod
+    def new_message(role: str, content: str) -> Dict[str, Any]:
+        """Build a chat message stamped with the current time"""
+        return {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
     async def save_message(self, chat_id: str, role: str, content: str):
+        await self.save_messages(chat_id, [self.new_message(role, content)])
+
+    async def save_messages(self, chat_id: str, messages: List[Dict[str, Any]]):
+        """Append several messages to a chat in a single write"""
         if not mongodb_available:
             logger.error("MongoDB connection not available")
             raise HTTPException(
@@ -77,14 +141,9 @@ class ChatManager:
                 detail="MongoDB is not available. Please ensure MongoDB is running."
             )
         try:
-            message = {
-                "role": role,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            result = chat_collection.update_one(
+            result = await chat_collection.update_one(
                 {"chat_id": chat_id},
-                {"$push": {"messages": message}},
+                {"$push": {"messages": {"$each": messages}}},
                 upsert=True
             )
             if result.matched_count == 0 and not result.upserted_id:
@@ -93,7 +152,7 @@ class ChatManager:
                     status_code=500,
                     detail="Failed to save message"
                 )
-            logger.info(f"Saved message for chat ID: {chat_id}")
+            logger.debug(f"Saved {len(messages)} message(s) for chat ID: {chat_id}")
         except Exception as e:
             logger.error(f"Error saving message: {str(e)}")
             raise HTTPException(
@@ -109,14 +168,21 @@ class ChatManager:
                 detail="MongoDB is not available. Please ensure MongoDB is running."
             )
         try:
-            chat_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            print(f"Creating new chat with ID: {chat_id}")
-            chat = {
-                "chat_id": chat_id,
-                "messages": [],
-                "created_at": datetime.utcnow().isoformat()
-            }
-            result = chat_collection.insert_one(chat)
+            for attempt in range(CREATE_CHAT_ATTEMPTS):
+                now = datetime.utcnow()
+                chat_id = now.strftime("%Y%m%d_%H%M%S_%f")
+                chat = {
+                    "chat_id": chat_id,
+                    "messages": [],
+                    "created_at": now.isoformat()
+                }
+                try:
+                    result = await chat_collection.insert_one(chat)
+                    break
+                except DuplicateKeyError:
+                    # Another chat was created in the same microsecond
+                    if attempt == CREATE_CHAT_ATTEMPTS - 1:
+                        raise
             if not result.inserted_id:
                 logger.error("Failed to create new chat")
                 raise HTTPException(
@@ -133,6 +199,11 @@ class ChatManager:
             )
 
     async def validate_chat_id(self, chat_id: str) -> bool:
+        # Reject malformed IDs (e.g. from URL scanners) without a database query
+        if not CHAT_ID_RE.fullmatch(chat_id):
+            logger.info(f"Rejected malformed chat ID: {chat_id}")
+            return False
+
         if not mongodb_available:
             logger.error("MongoDB connection not available")
             raise HTTPException(
@@ -140,9 +211,9 @@ class ChatManager:
                 detail="MongoDB is not available. Please ensure MongoDB is running."
             )
         try:
-            chat = chat_collection.find_one({"chat_id": chat_id})
+            chat = await chat_collection.find_one({"chat_id": chat_id}, {"_id": 1})
             exists = chat is not None
-            logger.info(
+            logger.debug(
                 f"Validated chat ID {chat_id}: {'exists' if exists else 'not found'}")
             return exists
         except Exception as e:
@@ -173,6 +244,12 @@ async def create_chat():
         )
 
 
+@router.get("/api/chat/stats")
+async def get_cache_stats():
+    """Report how well the prompt embedding cache is doing"""
+    return {"embeddings": embedding_cache.stats()}
+
+
 @router.get("/api/chat/{chat_id}/history")
 async def get_chat_history(chat_id: str):
     try:
@@ -201,43 +278,47 @@ async def process_message(chat_id: str, message: Dict[str, str]):
             raise HTTPException(
                 status_code=400, detail="Message content is required")
 
-        # Save user message
-        await chat_manager.save_message(chat_id, "user", user_message)
+        # The user message is saved together with the response, in one write
+        # at the end of the turn
+        turn = [chat_manager.new_message("user", user_message)]
+
+        # Get chat history for context; the agent only looks at the last 10 messages
+        history = await chat_manager.get_chat_history(chat_id, limit=10)
+        browser_agent.chat_history = [*history, turn[0]]
 
-        # Get chat history for context
-        browser_agent.chat_history = await chat_manager.get_chat_history(chat_id)
+        # Only the action type is cached. The command the model wrote may carry
+        # details of the earlier message (URLs, credentials), so a hit runs
+        # this message as the command instead
+        cache_vector = await decision_cache.embed(user_message)
+        action_type = decision_cache.get(cache_vector)
 
         # Prepare messages for GPT
         messages = [
-            {
-                "role": "system",
-                "content": """
-                You are a browser automation assistant. Analyze the user's message and determine whether to:
-                1. Execute a browser action (using the execute_command API)
-                2. Extract data from the current page (using the extract API)
-                
-                Respond with a JSON object containing:
-                {
-                    "action_type": "execute" or "extract",
-                    "command": "the command to execute" or "the data to extract"; the command will be passed to another AI model to generate a json,
-                    "explanation": "brief explanation of your decision"
-                }
-                """
-            },
+            {"role": "system", "content": _DECISION_SYSTEM_PROMPT},
             {
                 "role": "user",
                 "content": user_message
             }
         ]
 
-        # Get response from GPT using browser_agent's client
-        response = browser_agent.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
-
         try:
-            decision = json.loads(response.choices[0].message.content.strip())
+            if action_type is None:
+                # Get response from GPT using browser_agent's client
+                response = await browser_agent.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    response_format={"type": "json_object"}
+                )
+                decision = orjson.loads(
+                    response.choices[0].message.content.strip())
+                if (not isinstance(decision, dict)
+                        or decision.get("action_type") not in ("execute", "extract")
+                        or not isinstance(decision.get("command"), str)):
+                    raise Exception(f"Invalid decision from GPT: {decision}")
+                cached = False
+            else:
+                decision = {"action_type": action_type, "command": user_message}
+                cached = True
 
             # Execute the appropriate action
             if decision["action_type"] == "execute":
@@ -245,15 +326,18 @@ async def process_message(chat_id: str, message: Dict[str, str]):
             else:  # extract
                 result = await browser_agent.extract(decision["command"])
 
+            # Only reuse decisions that led somewhere
+            if not cached and result.get("status") == "success":
+                decision_cache.put(cache_vector, decision["action_type"])
+
             # Save assistant's response
-            await chat_manager.save_message(
-                chat_id,
+            turn.append(chat_manager.new_message(
                 "assistant",
-                json.dumps({
+                orjson.dumps({
                     "decision": decision,
                     "result": result
-                })
-            )
+                }).decode()
+            ))
 
             return {
                 "status": "success",
@@ -261,12 +345,15 @@ async def process_message(chat_id: str, message: Dict[str, str]):
                 "result": result
             }
 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             raise HTTPException(
                 status_code=500, detail="Invalid response from GPT")
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error executing command: {str(e)}")
+        finally:
+            # Keep the user message even if the turn failed
+            await chat_manager.save_messages(chat_id, turn)
 
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
@@ -284,31 +371,34 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: str):
         while True:
             try:
                 data = await websocket.receive_text()
-                message = json.loads(data)
+                message = orjson.loads(data)
 
-                # Process message and get response
-                response = await process_message(chat_id, message)
+                # Clients may batch several messages into one frame
+                messages = message if isinstance(message, list) else [message]
+                for message in messages:
+                    # Process message and get response
+                    response = await process_message(chat_id, message)
 
-                # Send response back to client
-                await websocket.send_text(json.dumps(response))
+                    # Send response back to client
+                    await websocket.send_text(orjson.dumps(response).decode())
 
             except WebSocketDisconnect:
-                print(f"WebSocket disconnected for chat {chat_id}")
+                logger.info(f"WebSocket disconnected for chat {chat_id}")
                 break
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({
+            except orjson.JSONDecodeError:
+                await websocket.send_text(orjson.dumps({
                     "status": "error",
                     "message": "Invalid message format"
-                }))
+                }).decode())
             except Exception as e:
-                print(f"Error processing message: {str(e)}")
-                await websocket.send_text(json.dumps({
+                logger.error(f"Error processing message: {str(e)}")
+                await websocket.send_text(orjson.dumps({
                     "status": "error",
                     "message": str(e)
-                }))
+                }).decode())
 
     except Exception as e:
-        print(f"WebSocket error: {str(e)}")
+        logger.error(f"WebSocket error: {str(e)}")
         try:
             await websocket.close(code=1011, reason=str(e))
         except:
@@ -336,6 +426,9 @@ async def repeat_chat_process(chat_id: str):
 
         new_chat_id = await chat_manager.create_chat()
 
+        # Embed all messages at once instead of one request per replayed message
+        await decision_cache.prefetch([msg["content"] for msg in user_messages])
+
         # Return the new chat ID immediately
         return {
             "status": "success",
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from typing import Optional, Dict
+import numpy as np
+
+
+class EmbeddingCache:
+    """LRU cache of prompt embeddings, keyed by the stripped prompt text"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    @staticmethod
+    def key(text: str) -> str:
+        """Normalize a prompt so copies differing only in surrounding whitespace share an entry"""
+        # Case is kept: cached plans replay literal arguments such as typed
+        # text, so "Type Hello" and "type hello" must not share an embedding
+        return text.strip()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Get the cached embedding of a prompt, marking it as recently used"""
+        vector = self._vectors.get(self.key(text))
+        if vector is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._vectors.move_to_end(self.key(text))
+        return vector
+
+    def put(self, text: str, vector: np.ndarray):
+        """Cache the embedding of a prompt, evicting the least recently used one if full"""
+        # Entries are shared by every caller, so don't let anyone modify them
+        vector.flags.writeable = False
+        self._vectors[self.key(text)] = vector
+        self._vectors.move_to_end(self.key(text))
+        if len(self._vectors) > self.maxsize:
+            self._vectors.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the size and hit/miss counters of the cache"""
+        return {
+            "size": len(self._vectors),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Shared by every semantic cache. Replayed chats send the same prompts again
+embedding_cache = EmbeddingCache()
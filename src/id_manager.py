@@ -1,17 +1,18 @@
+import itertools
 
 
 class IdManager:
     """Manages unique IDs for CDP commands"""
 
     def __init__(self):
-        self._current_id = 0
+        # next() on a count is a single C-level step, so concurrent callers
+        # can't be handed the same ID
+        self._counter = itertools.count(1)
 
     def next_id(self) -> int:
         """Get the next available ID"""
-        self._current_id += 1
-        return self._current_id
+        return next(self._counter)
 
     def get_ids(self, count: int) -> list:
         """Get multiple sequential IDs"""
-        ids = [self.next_id() for _ in range(count)]
-        return ids
+        return list(itertools.islice(self._counter, count))
@@ -0,0 +1,32 @@
+import asyncio
+from typing import Optional, Dict, Set
+
+
+class CdpConnection:
+    """WebSocket connection to a DevTools target and its in-flight commands"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        # Futures of in-flight commands, resolved by the reader task
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.reader_task: Optional[asyncio.Task] = None
+
+
+class PageSession(CdpConnection):
+    """CDP connection to a single page and the browser context it lives in"""
+
+    def __init__(self, ws, target_id: str, browser_context_id: Optional[str] = None):
+        super().__init__(ws)
+        self.target_id = target_id
+        self.browser_context_id = browser_context_id
+        # CDP domains enabled on this connection, e.g. "Page"
+        self.enabled_domains: Set[str] = set()
+        # Document root, cached until the page navigates or reloads
+        self.root_node_id: Optional[int] = None
+        # Cleared while the main frame is loading, set on its load event
+        self.loaded = asyncio.Event()
+        self.loaded.set()
+        # Set when the main frame starts loading; cleared by whoever waits
+        # for an action to trigger a navigation
+        self.navigation_started = asyncio.Event()
+
@@ -0,0 +1,178 @@
+import os
+import logging
+from collections import OrderedDict
+from typing import Optional, Any, List
+import numpy as np
+import hnswlib
+from openai import AsyncOpenAI
+
+from src.embedding_cache import embedding_cache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Scopes with fewer entries are scanned directly, which is faster than an index
+ANN_MIN_ENTRIES = 256
+
+
+class _Scope:
+    """Cached results of one scope, stored in a ring of slots"""
+
+    def __init__(self, dim: int):
+        # Prompt embeddings, one row per slot. The matrix is C-contiguous so
+        # a lookup is a single matrix-vector product over the used rows; it
+        # grows by doubling from a single row so small scopes stay small
+        self.vectors = np.empty((1, dim), dtype=np.float32)
+        self.values: List[Any] = []
+        # Number of results ever stored; the next one goes in slot added % max_entries
+        self.added = 0
+        # Approximate nearest neighbour index over the slots, once the scope is large
+        self.index: Optional[hnswlib.Index] = None
+
+
+class SemanticCache:
+    """Reuses model results for prompts that mean the same as an earlier one"""
+
+    def __init__(self, client: AsyncOpenAI, threshold: float, max_entries: int = 1000,
+                 max_scopes: int = 256):
+        """
+        Initialize an empty cache.
+
+        Args:
+            client: OpenAI client used to embed prompts
+            threshold: Minimum cosine similarity for a prompt to reuse a result
+            max_entries: Number of results kept per scope; the oldest are dropped first
+            max_scopes: Number of scopes kept; the least recently used is dropped first
+        """
+        self.client = client
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self.enabled = os.getenv("SEMANTIC_CACHE", "1") == "1"
+        # Least recently used first
+        self._scopes: OrderedDict[str, _Scope] = OrderedDict()
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Get the normalized embedding of a prompt, or None if the cache can't be used"""
+        if not self.enabled:
+            return None
+        vector = embedding_cache.get(text)
+        if vector is not None:
+            return vector
+        try:
+            response = await self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=text
+            )
+        except Exception as e:
+            # The cache is an optimization; carry on without it
+            logger.error(f"Error embedding prompt: {str(e)}")
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+        embedding_cache.put(text, vector)
+        return vector
+
+    async def prefetch(self, texts: List[str]):
+        """Embed several prompts in a single request so later embed calls hit the cache"""
+        if not self.enabled:
+            return
+        texts = [text for text in dict.fromkeys(texts) if embedding_cache.get(text) is None]
+        if not texts:
+            return
+        try:
+            response = await self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts
+            )
+        except Exception as e:
+            logger.error(f"Error embedding prompts: {str(e)}")
+            return
+        for text, item in zip(texts, response.data):
+            vector = np.asarray(item.embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector)
+            embedding_cache.put(text, vector)
+
+    def get(self, vector: Optional[np.ndarray], scope: str = "") -> Optional[Any]:
+        """Get the result of the most similar prompt in a scope, if it is similar enough"""
+        if vector is None or scope not in self._scopes:
+            return None
+        self._scopes.move_to_end(scope)
+        slot = self._match(self._scopes[scope], vector)
+        if slot is None:
+            return None
+        return self._scopes[scope].values[slot]
+
+    def discard(self, vector: Optional[np.ndarray], scope: str = ""):
+        """Forget the result get would return for a prompt, e.g. because it stopped working"""
+        if vector is None or scope not in self._scopes:
+            return
+        entries = self._scopes[scope]
+        slot = self._match(entries, vector)
+        if slot is not None:
+            # The slot stays in the ring and is skipped by lookups until reused
+            entries.values[slot] = None
+
+    def _match(self, entries: _Scope, vector: np.ndarray, live: bool = True) -> Optional[int]:
+        """Get the slot of the most similar prompt in a scope, if it is similar enough"""
+        if not entries.values:
+            return None
+        if entries.index is not None:
+            labels, distances = entries.index.knn_query(vector, k=1)
+            best = int(labels[0][0])
+            score = 1 - float(distances[0][0])
+        else:
+            scores = entries.vectors[:len(entries.values)] @ vector
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+        if score < self.threshold or (live and entries.values[best] is None):
+            return None
+        if live:
+            logger.info(f"Semantic cache hit (similarity {score:.3f})")
+        return best
+
+    def put(self, vector: Optional[np.ndarray], value: Any, scope: str = ""):
+        """Store the result for a prompt in a scope, replacing the one a lookup would find"""
+        if vector is None:
+            return
+        entries = self._scopes.get(scope)
+        if entries is None:
+            entries = self._scopes[scope] = _Scope(len(vector))
+            if len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+        else:
+            self._scopes.move_to_end(scope)
+
+        # Refresh a matching result in place rather than storing a near-copy;
+        # this also refills a discarded slot, which would otherwise shadow
+        # the new result
+        slot = self._match(entries, vector, live=False)
+        if slot is not None:
+            entries.values[slot] = value
+            return
+
+        # Once the scope is full, the oldest result is overwritten
+        slot = entries.added % self.max_entries
+        entries.added += 1
+        if slot < len(entries.values):
+            entries.values[slot] = value
+        else:
+            if slot == len(entries.vectors):
+                capacity = min(2 * len(entries.vectors), self.max_entries)
+                entries.vectors = np.resize(entries.vectors, (capacity, len(vector)))
+            entries.values.append(value)
+        entries.vectors[slot] = vector
+
+        if entries.index is not None:
+            # Adding an existing label replaces its vector
+            entries.index.add_items(vector[np.newaxis], [slot])
+        elif len(entries.values) >= ANN_MIN_ENTRIES:
+            entries.index = self._build_index(entries.vectors[:len(entries.values)])
+
+    def _build_index(self, vectors: np.ndarray) -> hnswlib.Index:
+        """Build an HNSW index over the vectors of a scope, labelled by slot"""
+        index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+        index.init_index(max_elements=self.max_entries, ef_construction=200, M=16)
+        index.set_ef(50)
+        index.add_items(vectors, np.arange(len(vectors)))
+        return index